@@ -376,6 +376,12 @@ class TCPDeviceCloudMonitor(DeviceCloudMonitor):
         DeviceCloudMonitor.__init__(self, conn, monitor_id)
         self._tcp_client_manager = tcp_client_manager
 
-    def add_callback(self, callback):
-        """Create a secure SSL/TCP listen session to Device Cloud"""
-        self._tcp_client_manager.create_session(callback, self._id)
+    def add_callback(self, callback, raw=False):
+        """Create a secure SSL/TCP listen session to Device Cloud
+
+        :param callback: Function called with each pushed document.  It must
+            return True once the document has been processed.
+        :param raw: If True, the callback is passed the undecoded JSON
+            document as bytes.
+        """
+        self._tcp_client_manager.create_session(callback, self._id, raw)
@@ -7,19 +7,29 @@
 # This code is originally from another Digi Open Source Library:
 # https://github.com/digidotcom/idigi-python-monitor-api
 
-import json
 import logging
 import socket
 import struct
-from threading import Thread
+from collections import deque
+from threading import Thread, RLock, Event, current_thread
 import errno
-import select
-import zlib
+import selectors
 import ssl
 
 import pkg_resources
-from six.moves.queue import Queue, Empty
-import six
+
+try:
+    # Parse pushed JSON documents with orjson when it is available.
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+try:
+    # Decompress pushed messages with ISA-L when it is available, it is
+    # API compatible with zlib.
+    from isal import isal_zlib as zlib
+except ImportError:
+    import zlib
 
 DEFAULT_CRT_NAME = "devicecloud.crt"
 
@@ -43,64 +53,197 @@ STATUS_BAD_REQUEST = 400
 PUSH_OPEN_PORT = 3200
 PUSH_SECURE_PORT = 3201
 
-
-def _read_msg_header(session):
+# TCP keepalive settings for Push sockets, a dead connection is detected
+# after roughly 60 + 10 * 3 seconds without a response from the peer.
+TCP_KEEPALIVE_OPTIONS = (
+    ('TCP_KEEPIDLE', 60),
+    ('TCP_KEEPINTVL', 10),
+    ('TCP_KEEPCNT', 3),
+)
+
+# Kernel receive buffer size requested for Push sockets, large enough to
+# hold several complete messages between reads.  Note that on Linux a fixed
+# SO_RCVBUF turns off receive buffer autotuning for the socket.
+SOCKET_RECEIVE_BUFFER_SIZE = 256 * 1024
+
+# Pre-compiled layouts for the fixed size fields of the protocol.
+# Message Header : Type [2 bytes] & Length [4 Bytes].
+_MSG_HEADER = struct.Struct('!HI')
+# ConnectionResponse : Type [2 bytes], Length [4 bytes], Status [2 bytes]
+# & 2 unused bytes.
+_CONNECTION_RESPONSE = struct.Struct('!H4xH2x')
+# PublishMessage Header : Block ID [2 bytes], Compression [1 byte at offset 4],
+# 10 bytes in total.
+_PUBLISH_MESSAGE = struct.Struct('!H2xB5x')
+# PublishMessageReceived : Type [2 bytes], Block ID [2 bytes] & Status [2 bytes].
+_PUBLISH_MESSAGE_RECEIVED = struct.Struct('!HHH')
+
+# Size of the receive buffer kept by each session.  The buffer grows to fit
+# larger messages and is shrunk back to this size once they are consumed.
+RECEIVE_BUFFER_SIZE = 16384
+
+
+def _read_msgs(session):
     """
-    Perform a read on input socket to consume headers and then return
-    a tuple of message type, message length.
+    Perform a single read on input socket and consume every message that
+    has been completely received.  Data of a message that is not yet
+    complete is kept in the session buffer for the next read.
 
     :param session: Push Session to read data for.
 
-    Returns response type (i.e. PUBLISH_MESSAGE) if header was completely
-    read, otherwise None if header was not completely read.
+    Returns NO_DATA if the socket was closed, otherwise a list of
+    (response type, block id, payload) tuples for the messages consumed.
+    Block id and payload are None for messages other than PublishMessage
+    and the payload is None if it could not be decompressed.
+
+    If the SSL socket has to send data before it can read more,
+    ``session.read_wants_write`` is set and the read should be retried once
+    the socket is writable.  Any other :class:`ssl.SSLError` than the SSL
+    socket waiting to read or write more data is raised, as the session
+    can't be recovered from it.
     """
-    try:
-        data = session.socket.recv(6 - len(session.data))
-        if len(data) == 0:  # No Data on Socket. Likely closed.
+    messages = []
+    session.read_wants_write = False
+    while True:
+        view = memoryview(session.data)
+        try:
+            nbytes = session.socket.recv_into(view[session.data_length:])
+        except (ssl.SSLWantReadError, BlockingIOError):
+            # This can happen when select gets triggered
+            # for an SSL socket and a complete record has not
+            # yet been received, or the wakeup was spurious.
+            # Wait for it to get triggered again.
+            return messages
+        except ssl.SSLWantWriteError:
+            # The SSL socket could not send data it needs to send before
+            # reading more (e.g. during a renegotiation).
+            session.read_wants_write = True
+            return messages
+        finally:
+            # Release the export so that the buffer may be resized later.
+            view.release()
+
+        if nbytes == 0:  # No Data on Socket. Likely closed.
             return NO_DATA
-        session.data += data
-        # Data still not completely read.
-        if len(session.data) < 6:
-            return INCOMPLETE
+        session.data_length += nbytes
+        messages.extend(_consume_msgs(session))
 
-    except ssl.SSLError:
-        # This can happen when select gets triggered
-        # for an SSL socket and data has not yet been
-        # read.
-        return INCOMPLETE
+        # An SSL socket may still hold decrypted data that did not fit in the
+        # buffer, the selector would not be triggered again for it.
+        if not isinstance(session.socket, ssl.SSLSocket) or not session.socket.pending():
+            return messages
 
-    session.message_length = struct.unpack('!i', session.data[2:6])[0]
-    response_type = struct.unpack('!H', session.data[0:2])[0]
 
-    # Clear out session data as header is consumed.
-    session.data = six.b("")
-    return response_type
+def _consume_msgs(session):
+    """
+    Consume the messages completely received in the session buffer, moving
+    data of a message that is not yet complete to the start of the buffer.
 
+    :param session: Push Session to consume data for.
 
-def _read_msg(session):
+    Returns a list of (response type, block id, payload) tuples.
     """
-    Perform a read on input socket to consume message and then return the
-    payload and block_id in a tuple.
-
-    :param session: Push Session to read data for.
+    messages = []
+    offset = 0
+    while True:
+        if session.response_type is None:
+            # Parse the header of the next message.
+            if session.data_length - offset < _MSG_HEADER.size:
+                break
+            session.response_type, session.message_length = _MSG_HEADER.unpack_from(session.data, offset)
+            offset += _MSG_HEADER.size
+
+        if session.data_length - offset < session.message_length:
+            # Message not yet completely read, start decompressing what
+            # has been received so far.
+            if session.response_type == PUBLISH_MESSAGE:
+                _decompress_msg(session, offset, session.data_length)
+            break
+
+        messages.append(_parse_msg(session, offset))
+        offset += session.message_length
+        session.response_type = None
+        session.message_length = 0
+
+    if offset:
+        # Move what is left of the data to the start of the buffer.
+        remaining = session.data_length - offset
+        with memoryview(session.data) as view:
+            view[:remaining] = view[offset:session.data_length]
+        session.data_length = remaining
+
+    # Make sure the buffer can hold the whole message, and give back
+    # memory held on to for a previous large message.
+    if session.message_length > len(session.data):
+        session.data.extend(bytes(session.message_length - len(session.data)))
+    elif len(session.data) > RECEIVE_BUFFER_SIZE >= max(session.message_length, session.data_length):
+        del session.data[RECEIVE_BUFFER_SIZE:]
+    return messages
+
+
+def _parse_msg(session, offset):
     """
-    if len(session.data) == session.message_length:
-        # Data Already completely read.  Return
-        return True
+    Parse a message that has been completely received.
 
-    try:
-        data = session.socket.recv(session.message_length - len(session.data))
-        if len(data) == 0:
-            raise PushException("No Data on Socket!")
-        session.data += data
-    except ssl.SSLError:
-        # This can happen when select gets triggered
-        # for an SSL socket and data has not yet been
-        # read.  Wait for it to get triggered again.
-        return False
+    :param session: Push Session the message was received by.
+    :param offset: Offset of the message body in the session buffer.
+
+    Returns a (response type, block id, payload) tuple.
+    """
+    if session.response_type != PUBLISH_MESSAGE:
+        return session.response_type, None, None
+
+    end = offset + session.message_length
+    _decompress_msg(session, offset, end)
+    block_id = _PUBLISH_MESSAGE.unpack_from(session.data, offset)[0]
+    if session.decompressed is None:
+        # Payload could not be decompressed.
+        payload = None
+    elif session.decompressor is not None:
+        # Data is compressed, finish uncompressing it.
+        session.decompressed.append(session.decompressor.flush())
+        payload = b"".join(session.decompressed)
+    else:
+        # Copy payload out as the buffer is reused.
+        with memoryview(session.data)[offset + _PUBLISH_MESSAGE.size:end] as view:
+            payload = bytes(view)
+
+    session.decompressor = None
+    session.decompressed = []
+    session.decompressed_offset = 0
+    return PUBLISH_MESSAGE, block_id, payload
+
+
+def _decompress_msg(session, offset, end):
+    """
+    Decompress the payload of a compressed PublishMessage as it is
+    received, so that the work is spread over the reads for the message.
 
-    # Whether or not all data was read.
-    return len(session.data) == session.message_length
+    :param session: Push Session to decompress data for.
+    :param offset: Offset of the message body in the session buffer.
+    :param end: Offset in the session buffer where received data ends.
+    """
+    if session.decompressed_offset == 0:
+        if end - offset < _PUBLISH_MESSAGE.size:
+            return  # PublishMessage header not yet read
+
+        # PublishMessage header completely read, check for compression.
+        compression = _PUBLISH_MESSAGE.unpack_from(session.data, offset)[1]
+        if compression == 0x01:
+            session.decompressor = zlib.decompressobj()
+        session.decompressed_offset = _PUBLISH_MESSAGE.size
+
+    start = offset + session.decompressed_offset
+    if session.decompressor is not None and start < end:
+        with memoryview(session.data)[start:end] as view:
+            try:
+                session.decompressed.append(session.decompressor.decompress(view))
+            except zlib.error as err:
+                # Mark the message as unusable, it is dropped once received.
+                session.log.error("Unable to decompress message: %s" % err)
+                session.decompressor = None
+                session.decompressed = None
+    session.decompressed_offset = end - offset
 
 
 class PushException(Exception):
@@ -114,23 +257,41 @@ class PushSession(object):
     iDigi.
     """
 
-    def __init__(self, callback, monitor_id, client):
+    def __init__(self, callback, monitor_id, client, raw=False):
         """Creates a PushSession for use with Device Cloud
 
         :param callback: The callback function to invoke when data received.
             Must have 1 required parameter that will contain the payload.
         :param monitor_id: The id of the Monitor to observe.
         :param client: The client object this session is derived from.
+        :param raw: If True, the callback is passed the payload as bytes
+            rather than the decoded JSON document.
         """
         self.callback = callback
         self.monitor_id = monitor_id
         self.client = client
+        self.raw = raw
         self.socket = None
         self.log = logging.getLogger("%s.push_session.%s" % (__name__, monitor_id))
 
-        # Received protocol data holders.
-        self.data = six.b("")
+        # Received protocol data holders.  Only the first data_length
+        # bytes of the data buffer are valid, the type and length of the
+        # message being received are None and 0 until its header is read.
+        self.data = bytearray(RECEIVE_BUFFER_SIZE)
+        self.data_length = 0
+        self.response_type = None
         self.message_length = 0
+        # Decompressor, data decompressed so far and amount of the message
+        # handled by the decompressor for a compressed message that is
+        # being received (decompressed is None if decompression failed).
+        self.decompressor = None
+        self.decompressed = []
+        self.decompressed_offset = 0
+        # Whether the last read could not go on until the socket is writable,
+        # as an SSL socket may have to send data before it can read more.
+        self.read_wants_write = False
+        # Encoded ConnectionRequest message, built when first sent.
+        self._connection_request = None
 
     def send_connection_request(self):
         """
@@ -143,28 +304,23 @@ class PushSession(object):
                           % self.monitor_id)
             # Send connection request and perform a receive to ensure
             # request is authenticated.
-            # Protocol Version = 1.
-            payload = struct.pack('!H', 0x01)
-            # Username Length.
-            payload += struct.pack('!H', len(self.client.username))
-            # Username.
-            payload += six.b(self.client.username)
-            # Password Length.
-            payload += struct.pack('!H', len(self.client.password))
-            # Password.
-            payload += six.b(self.client.password)
-            # Monitor ID.
-            payload += struct.pack('!L', int(self.monitor_id))
-
-            # Header 6 Bytes : Type [2 bytes] & Length [4 Bytes]
-            # ConnectionRequest is Type 0x01.
-            data = struct.pack("!HL", CONNECTION_REQUEST, len(payload))
-
-            # The full payload.
-            data += payload
+            if self._connection_request is None:
+                # The credentials and monitor id do not change, so the
+                # request is built once and reused when restarting.
+                username = self.client.username.encode('latin-1')
+                password = self.client.password.encode('latin-1')
+                # Header 6 Bytes : Type [2 bytes] & Length [4 Bytes]
+                # ConnectionRequest is Type 0x01.
+                # Payload : Protocol Version [2 bytes], Username Length [2 bytes],
+                # Username, Password Length [2 bytes], Password & Monitor ID
+                # [4 bytes].  Protocol Version = 1.
+                request = struct.Struct('!HLHH%dsH%dsL' % (len(username), len(password)))
+                self._connection_request = request.pack(
+                    CONNECTION_REQUEST, request.size - _MSG_HEADER.size, 0x01,
+                    len(username), username, len(password), password, int(self.monitor_id))
 
             # Send Connection Request.
-            self.socket.send(data)
+            self.socket.send(self._connection_request)
 
             # Set a 60 second blocking on recv, if we don't get any data
             # within 60 seconds, timeout which will throw an exception.
@@ -180,14 +336,13 @@ class PushSession(object):
                 raise PushException("Length of Connection Request Response "
                                     "(%d) is not 10." % len(response))
 
-            # Type
-            response_type = int(struct.unpack("!H", response[0:2])[0])
+            # Type & Status
+            response_type, status_code = _CONNECTION_RESPONSE.unpack_from(response, 0)
             if response_type != CONNECTION_RESPONSE:
                 raise PushException(
                     "Connection Response Type (%d) is not "
                     "ConnectionResponse Type (%d)." % (response_type, CONNECTION_RESPONSE))
 
-            status_code = struct.unpack("!H", response[6:8])[0]
             self.log.info("Got ConnectionResponse for Monitor %s. Status %s."
                           % (self.monitor_id, status_code))
             if status_code != STATUS_OK:
@@ -200,6 +355,21 @@ class PushSession(object):
             self.socket = None
             raise exception
 
+    def _create_socket(self):
+        """Creates the TCP socket used to connect to Device Cloud"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # PublishMessageReceived messages are small, send them right away
+        # rather than waiting for more data to go out with them.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Detect connections that went away without being closed.
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for name, value in TCP_KEEPALIVE_OPTIONS:
+            if hasattr(socket, name):  # not available on all platforms
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+        # Set before connecting so that the TCP window can be scaled to it.
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RECEIVE_BUFFER_SIZE)
+        return sock
+
     def start(self):
         """Creates a TCP connection to Device Cloud and sends a ConnectionRequest message"""
         self.log.info("Starting Insecure Session for Monitor %s" % self.monitor_id)
@@ -207,7 +377,7 @@ class PushSession(object):
             raise Exception("Socket already established for %s." % self)
 
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket = self._create_socket()
             self.socket.connect((self.client.hostname, PUSH_OPEN_PORT))
             self.socket.setblocking(0)
         except socket.error as exception:
@@ -226,7 +396,13 @@ class PushSession(object):
         if self.socket is not None:
             self.socket.close()
             self.socket = None
-            self.data = None
+            self.data_length = 0
+            self.response_type = None
+            self.message_length = 0
+            self.decompressor = None
+            self.decompressed = []
+            self.decompressed_offset = 0
+            self.read_wants_write = False
 
 
 class SecurePushSession(PushSession):
@@ -236,7 +412,7 @@ class SecurePushSession(PushSession):
     in ca_certs member file.
     """
 
-    def __init__(self, callback, monitor_id, client, ca_certs=None):
+    def __init__(self, callback, monitor_id, client, ca_certs=None, raw=False):
         """
         Creates a PushSession wrapped in SSL for use with interacting with
         Device Cloud push functionality.
@@ -249,8 +425,10 @@ class SecurePushSession(PushSession):
         :param ca_certs: Path to a file containing Certificates.
             If not provided, the devicecloud.crt file provided with the module will
             be used.  In most cases, the devicecloud.crt file should be acceptable.
+        :param raw: If True, the callback is passed the payload as bytes
+            rather than the decoded JSON document.
         """
-        PushSession.__init__(self, callback, monitor_id, client)
+        PushSession.__init__(self, callback, monitor_id, client, raw)
         # Fall back on devicecloud.crt in the same path as this module if not
         # specified.
         if ca_certs is None:
@@ -269,14 +447,17 @@ class SecurePushSession(PushSession):
 
         try:
             # Create socket, wrap in SSL and connect.
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket = self._create_socket()
             # Validate that certificate server uses matches what we expect.
+            # As before, the hostname the certificate was issued for is not
+            # checked.
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.check_hostname = False
             if self.ca_certs is not None:
-                self.socket = ssl.wrap_socket(self.socket,
-                                              cert_reqs=ssl.CERT_REQUIRED,
-                                              ca_certs=self.ca_certs)
+                context.load_verify_locations(self.ca_certs)
             else:
-                self.socket = ssl.wrap_socket(self.socket)
+                context.verify_mode = ssl.CERT_NONE
+            self.socket = context.wrap_socket(self.socket, server_hostname=self.client.hostname)
 
             self.socket.connect((self.client.hostname, PUSH_SECURE_PORT))
             self.socket.setblocking(0)
@@ -294,66 +475,95 @@ class CallbackWorkerPool(object):
     used for invoking Session callbacks.
     """
 
-    def __init__(self, write_queue=None, size=1):
+    def __init__(self, writer=None, size=1):
         """
         Creates a Callback Worker Pool for use in invoking Session Callbacks
         when data is received by a push client.
 
-        :param write_queue: Queue used for queueing up socket write events
-            for when a payload message is received and processed.
-        :param size: The number of worker threads to invoke callbacks.
+        :param writer: Function called with a session and the data to send
+            on its socket for when a payload message is received and processed.
+        :param size: The number of worker threads to invoke callbacks.  If 0,
+            no threads are created and callbacks are invoked by the thread
+            queueing them.
         """
-        # Used to queue up PublishMessageReceived events to be sent back to
-        # the iDigi server.
-        self._write_queue = write_queue
-        # Used to queue up sessions and data to callback with.
-        self._queue = Queue(size)
+        # Used to send PublishMessageReceived events back to the iDigi
+        # server.
+        self._writer = writer
+        # Used to queue up sessions and data to callback with.  Each worker
+        # has its own queue, only fed by the IO thread, and is signalled
+        # through an Event when data is added to it.
+        self._queues = [(deque(), Event()) for _ in range(size)]
         # Number of workers to create.
         self.size = size
         self.log = logging.getLogger('{}.callback_worker_pool'.format(__name__))
 
-        for _ in range(size):
-            worker = Thread(target=self._consume_queue)
+        for queue, event in self._queues:
+            worker = Thread(target=self._consume_queue, args=(queue, event))
             worker.daemon = True
             worker.start()
 
-    def _consume_queue(self):
+    def _consume_queue(self, queue, event):
         """
-        Continually blocks until data is on the internal queue, then calls
+        Continually blocks until data is on the given queue, then calls
         the session's registered callback and sends a PublishMessageReceived
         if callback returned True.
+
+        :param queue: the worker's queue of callback events.
+        :param event: the event set when data is added to the queue.
         """
         while True:
-            session, block_id, raw_data = self._queue.get()
-            data = json.loads(raw_data.decode('utf-8'))  # decode as JSON
             try:
-                result = session.callback(data)
-                if result is None:
-                    self.log.warn("Callback %r returned None, expected boolean.  Messages "
-                                  "are not marked as received unless True is returned", session.callback)
-                elif result:
-                    # Send a Successful PublishMessageReceived with the
-                    # block id sent in request
-                    if self._write_queue is not None:
-                        response_message = struct.pack('!HHH',
-                                                       PUBLISH_MESSAGE_RECEIVED,
-                                                       block_id, 200)
-                        self._write_queue.put((session.socket, response_message))
-            except Exception as exception:
-                self.log.exception(exception)
-
-            self._queue.task_done()
+                session, block_id, raw_data = queue.popleft()
+            except IndexError:
+                # Queue is empty, wait for more.  As the queue is checked
+                # again after clearing the event, no data is missed.
+                event.wait()
+                event.clear()
+                continue
+            self._invoke_callback(session, block_id, raw_data)
+
+    def _invoke_callback(self, session, block_id, raw_data):
+        """
+        Calls the session's registered callback with the decoded payload and
+        sends a PublishMessageReceived if callback returned True.
+        """
+        try:
+            if session.raw:
+                data = raw_data
+            else:
+                data = _json_loads(raw_data)  # decode as JSON
+            result = session.callback(data)
+            if result is None:
+                self.log.warn("Callback %r returned None, expected boolean.  Messages "
+                              "are not marked as received unless True is returned", session.callback)
+            elif result:
+                # Send a Successful PublishMessageReceived with the
+                # block id sent in request
+                if self._writer is not None:
+                    response_message = _PUBLISH_MESSAGE_RECEIVED.pack(
+                        PUBLISH_MESSAGE_RECEIVED, block_id, STATUS_OK)
+                    self._writer(session, response_message)
+        except Exception as exception:
+            self.log.exception(exception)
 
     def queue_callback(self, session, block_id, data):
         """
         Queues up a callback event to occur for a session with the given
-        payload data.  Will block if the queue is full.
+        payload data.  Callbacks for a session are always queued for the
+        same worker, so they are invoked in the order data was received.
+        Without worker threads, the callback is invoked before returning.
 
         :param session: the session with a defined callback function to call.
         :param block_id: the block_id of the message received.
         :param data: the data payload of the message received.
         """
-        self._queue.put((session, block_id, data))
+        if self.size == 0:
+            self._invoke_callback(session, block_id, data)
+        else:
+            queue, event = self._queues[hash(session) % self.size]
+            queue.append((session, block_id, data))
+            if not event.is_set():
+                event.set()
 
 
 class TCPClientManager(object):
@@ -369,21 +579,36 @@ class TCPClientManager(object):
             If not provided, the devicecloud.crt file provided with the module will
             be used.  In most cases, the devicecloud.crt file should be acceptable.
         :param workers: Number of workers threads to process callback calls.
+            If 0, callbacks are called directly from the I/O thread.  This
+            avoids handing every message over to another thread, but a slow
+            callback delays reading from all sessions.
         """
         self._conn = conn
         self._secure = secure
         self._ca_certs = ca_certs
 
-        # A dict mapping Sockets to their PushSessions
-        self.sessions = {}
-        # IO thread is used monitor sockets and consume data.
+        # Selector tracking the sockets of all active PushSessions, each
+        # registered with its session as the key data.
+        self._selector = selectors.DefaultSelector()
+        # Socket pair used to wake up the IO thread when data is queued to
+        # be written from another thread, registered without key data.
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(0)
+        self._wakeup_writer.setblocking(0)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        # IO thread is used monitor sockets, consume data and send any
+        # data that could not be written right away.
         self._io_thread = None
-        # Writer thread is used to send data on sockets.
-        self._writer_thread = None
-        # Write queue is used to queue up data to write to sockets.
-        self._write_queue = Queue()
+        # A dict mapping PushSessions to the data waiting to be written to
+        # their socket.
+        self._pending_writes = {}
+        # A dict mapping PushSessions whose pending data could not be sent
+        # to the selector event to wait for before sending it again.
+        self._write_waits = {}
+        # Guards writes to sockets and the pending writes.
+        self._write_lock = RLock()
         # A pool that monitors callback events and invokes them.
-        self._callback_pool = CallbackWorkerPool(self._write_queue, size=workers)
+        self._callback_pool = CallbackWorkerPool(self._write, size=workers)
 
         self.closed = False
         self.log = logging.getLogger(__name__)
@@ -400,6 +625,14 @@ class TCPClientManager(object):
     def password(self):
         return self._conn.password
 
+    @property
+    def sessions(self):
+        """A dict mapping socket file descriptors to their PushSessions"""
+        mapping = self._selector.get_map()
+        if mapping is None:
+            return {}  # the manager has been stopped
+        return {key.fd: key.data for key in mapping.values() if key.data is not None}
+
     def _restart_session(self, session):
         """Restarts and re-establishes session
 
@@ -410,37 +643,156 @@ class TCPClientManager(object):
         if session.socket is not None:
             self.log.info("Attempting restart session for Monitor Id %s."
                           % session.monitor_id)
-            del self.sessions[session.socket.fileno()]
+            self._unregister(session.socket)
             session.stop()
             session.start()
-            self.sessions[session.socket.fileno()] = session
+            self._register(session)
 
-    def _writer(self):
+    def _register(self, session):
+        """Registers the socket of a session with the selector
+
+        :param session: The session whose socket should be monitored
         """
-        Indefinitely checks the writer queue for data to write
-        to socket.
+        try:
+            self._selector.register(session.socket, selectors.EVENT_READ, session)
+        except KeyError:
+            # The file descriptor was reused from a session that was
+            # stopped without being unregistered, drop the stale entry.
+            self._clean_dead_sessions()
+            self._selector.register(session.socket, selectors.EVENT_READ, session)
+
+    def _unregister(self, sock):
+        """Removes a socket (or file descriptor) from the selector
+
+        :param sock: The socket or file descriptor to stop monitoring
         """
-        while not self.closed:
+        with self._write_lock:
             try:
-                sock, data = self._write_queue.get(timeout=0.1)
-                self._write_queue.task_done()
-                sock.send(data)
-            except Empty:
-                pass  # nothing to write after timeout
+                key = self._selector.unregister(sock)
+            except (KeyError, ValueError):
+                return  # already unregistered or no longer a valid descriptor
+            # Anything not yet sent was meant for this connection only.
+            self._pending_writes.pop(key.data, None)
+            self._write_waits.pop(key.data, None)
+
+    def _write(self, session, data):
+        """
+        Queues data to be written to the socket of a session.  Data queued
+        for a session is sent by the IO thread with a single send once per
+        loop iteration, so that acknowledgements for several messages go
+        out together.  The IO thread is woken up if data is queued from
+        another thread.
+
+        :param session: The session to write data for
+        :param data: The data to send on the session socket
+        """
+        with self._write_lock:
+            if session.socket is None:
+                return  # session has since been stopped
+            if session.socket not in (self._selector.get_map() or {}):
+                return  # session was unregistered
+
+            pending = self._pending_writes.get(session)
+            if pending is None:
+                pending = self._pending_writes[session] = bytearray()
+                if current_thread() is not self._io_thread:
+                    self._wakeup()
+            pending.extend(data)
+
+    def _wakeup(self):
+        """Wakes up the IO thread if it is waiting in select"""
+        try:
+            self._wakeup_writer.send(b"\0")
+        except OSError:
+            pass  # a wakeup is already pending, or the manager was stopped
+
+    def _update_events(self, session):
+        """
+        Monitors the socket of a session for writability only while a send
+        or a read has to wait for it.
+
+        :param session: The session to update the monitored events of
+        """
+        events = selectors.EVENT_READ
+        if session.read_wants_write or self._write_waits.get(session) == selectors.EVENT_WRITE:
+            events |= selectors.EVENT_WRITE
+        if self._selector.get_key(session.socket).events != events:
+            self._selector.modify(session.socket, events, session)
+
+    def _flush_writes(self, session):
+        """
+        Sends as much data waiting for the socket of a session as it will
+        accept without blocking.  If not everything could be sent, the rest
+        is sent once the socket is ready for it.
+
+        :param session: The session to send pending data for
+        """
+        with self._write_lock:
+            pending = self._pending_writes.get(session)
+            if pending is None or session.socket is None:
+                return
+
+            try:
+                sent = session.socket.send(pending)
+            except ssl.SSLWantReadError:
+                # The SSL socket has to receive data first, send the rest
+                # once it is readable.  The socket is already writable, so
+                # waiting for that would only wake us up again right away.
+                self._write_waits[session] = selectors.EVENT_READ
+                self._update_events(session)
+                return
+            except (ssl.SSLWantWriteError, BlockingIOError):
+                # Not writable right now, send the rest once it is.
+                self._write_waits[session] = selectors.EVENT_WRITE
+                self._update_events(session)
+                return
             except socket.error as err:
-                if err.errno == errno.EBADF:
-                    self._clean_dead_sessions()
+                # The connection is gone, what is waiting can't be sent on it.
+                del self._pending_writes[session]
+                self._write_waits.pop(session, None)
+                error = err
+            else:
+                del pending[:sent]
+                if pending:
+                    self._write_waits[session] = selectors.EVENT_WRITE
+                else:
+                    del self._pending_writes[session]
+                    self._write_waits.pop(session, None)
+                self._update_events(session)
+                return
+
+        # Restart outside of the lock, re-connecting may take a while.
+        self.log.error("Failed to send to Monitor %s: %s" % (session.monitor_id, error))
+        self._restart_session(session)
+
+    def _flush_all_writes(self):
+        """
+        Sends the data queued for every session that is not already waiting
+        for its socket to be ready for it.  Called by the IO thread once per
+        loop iteration.
+        """
+        if not self._pending_writes:
+            return
+
+        with self._write_lock:
+            sessions = [session for session in self._pending_writes
+                        if session.socket is not None and session not in self._write_waits]
+        for session in sessions:
+            self._flush_writes(session)
 
     def _clean_dead_sessions(self):
         """
         Traverses sessions to determine if any sockets
         were removed (indicates a stopped session).
         In these cases, remove the session.
+
+        Only needed when a socket operation reports a bad file descriptor,
+        the selector otherwise keeps track of the sockets to monitor.
         """
-        for sck in list(self.sessions.keys()):
-            session = self.sessions[sck]
-            if session.socket is None:
-                del self.sessions[sck]
+        dead = [fd for fd, key in self._selector.get_map().items()
+                if key.data is not None and key.data.socket is None]
+        for fd in dead:
+            self._unregister(fd)
 
     def _select(self):
         """
@@ -452,92 +804,93 @@ class TCPClientManager(object):
         try:
             while not self.closed:
                 try:
-                    inputready = select.select(self.sessions.keys(), [], [], 0.1)[0]
-                    for sock in inputready:
-                        session = self.sessions[sock]
+                    for key, events in self._selector.select(timeout=0.1):
+                        session = key.data
+                        if session is None:
+                            # Woken up to send data queued by another thread,
+                            # which happens below.
+                            self._wakeup_reader.recv(4096)
+                            continue
+
                         sck = session.socket
 
                         if sck is None:
                             # Socket has since been deleted, continue
                             continue
 
-                        # If no defined message length, nothing has been
-                        # consumed yet, parse the header.
-                        if session.message_length == 0:
-                            # Read header information before receiving rest of
-                            # message.
-                            response_type = _read_msg_header(session)
-                            if response_type == NO_DATA:
-                                # No data could be read, assume socket closed.
-                                if session.socket is not None:
-                                    self.log.error("Socket closed for Monitor %s." % session.monitor_id)
-                                    self._restart_session(session)
-                                continue
-                            elif response_type == INCOMPLETE:
-                                # More Data to be read.  Continue.
-                                continue
-                            elif response_type != PUBLISH_MESSAGE:
-                                self.log.warn("Response Type (%x) does not match PublishMessage (%x)"
-                                              % (response_type, PUBLISH_MESSAGE))
-                                continue
+                        if events & self._write_waits.get(session, 0):
+                            # Socket is ready for the data waiting to be sent.
+                            self._flush_writes(session)
+                            if session.socket is not sck:
+                                continue  # the session was restarted
+                        if not events & selectors.EVENT_READ and not session.read_wants_write:
+                            continue
 
+                        read_wanted_write = session.read_wants_write
                         try:
-                            if not _read_msg(session):
-                                # Data not completely read, continue.
-                                continue
-                        except PushException as err:
-                            # If Socket is None, it was closed,
-                            # otherwise it was closed when it shouldn't
-                            # have been restart it.
-                            session.data = six.b("")
-                            session.message_length = 0
+                            messages = _read_msgs(session)
+                        except ssl.SSLError as err:
+                            # SSL connection is broken, re-establish it.
+                            self.log.exception(err)
+                            self._restart_session(session)
+                            continue
 
+                        if messages == NO_DATA:
+                            # No data could be read, assume socket closed.
+                            # If Socket is None, it was closed, otherwise it
+                            # was closed when it shouldn't have been restart it.
                             if session.socket is None:
-                                del self.sessions[sck]
+                                self._unregister(key.fd)
                             else:
-                                self.log.exception(err)
+                                self.log.error("Socket closed for Monitor %s." % session.monitor_id)
                                 self._restart_session(session)
                             continue
 
-                        # We received full payload,
-                        # clear session data and parse it.
-                        data = session.data
-                        session.data = six.b("")
-                        session.message_length = 0
-                        block_id = struct.unpack('!H', data[0:2])[0]
-                        compression = struct.unpack('!B', data[4:5])[0]
-                        payload = data[10:]
-
-                        if compression == 0x01:
-                            # Data is compressed, uncompress it.
-                            payload = zlib.decompress(payload)
-
-                        # Enqueue payload into a callback queue to be
-                        # invoked
-                        self._callback_pool.queue_callback(session, block_id, payload)
-                except select.error as err:
+                        if session.read_wants_write != read_wanted_write:
+                            # Retry reading once the socket is writable, or
+                            # stop waiting for it.
+                            with self._write_lock:
+                                self._update_events(session)
+
+                        for response_type, block_id, payload in messages:
+                            if response_type != PUBLISH_MESSAGE:
+                                self.log.warn("Response Type (%x) does not match PublishMessage (%x)"
+                                              % (response_type, PUBLISH_MESSAGE))
+                            elif payload is not None:
+                                # Enqueue payload into a callback queue to be
+                                # invoked
+                                self._callback_pool.queue_callback(session, block_id, payload)
+
+                    # Send the acknowledgements queued since the last pass.
+                    self._flush_all_writes()
+                except socket.error as err:
                     # Evaluate sessions if we get a bad file descriptor, if
                     # socket is gone, delete the session.
                     if err.args[0] == errno.EBADF:
                         self._clean_dead_sessions()
+                    else:
+                        self.log.exception(err)
                 except Exception as err:
                     self.log.exception(err)
         finally:
-            for session in self.sessions.values():
-                if session is not None:
-                    session.stop()
+            for fd, session in list(self.sessions.items()):
+                self._unregister(fd)
+                session.stop()
+            self._close_selector()
+
+    def _close_selector(self):
+        """Closes the selector and the sockets used to wake it up"""
+        self._selector.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
 
     def _init_threads(self):
-        """Initializes the IO and Writer threads"""
+        """Initializes the IO thread"""
         if self._io_thread is None:
             self._io_thread = Thread(target=self._select)
             self._io_thread.start()
 
-        if self._writer_thread is None:
-            self._writer_thread = Thread(target=self._writer)
-            self._writer_thread.start()
-
-    def create_session(self, callback, monitor_id):
+    def create_session(self, callback, monitor_id, raw=False):
         """
         Creates and Returns a PushSession instance based on the input monitor
         and callback.  When data is received, callback will be invoked.
@@ -550,13 +903,17 @@ class TCPClientManager(object):
             the message, False or None otherwise.
         :param monitor_id: The id of the Monitor, will be queried
             to understand parameters of the monitor.
+        :param raw: If True, the callback is passed the payload of the pushed
+            message as bytes without decoding it.  This saves parsing the
+            whole document for callbacks that only need part of it, or
+            that pass the data on as is.
         """
         self.log.info("Creating Session for Monitor %s." % monitor_id)
-        session = SecurePushSession(callback, monitor_id, self, self._ca_certs) \
-            if self._secure else PushSession(callback, monitor_id, self)
+        session = SecurePushSession(callback, monitor_id, self, self._ca_certs, raw) \
+            if self._secure else PushSession(callback, monitor_id, self, raw)
 
         session.start()
-        self.sessions[session.socket.fileno()] = session
+        self._register(session)
 
         self._init_threads()
         return session
@@ -564,16 +921,13 @@ class TCPClientManager(object):
     def stop(self):
         """Stops all session activity.
 
-        Blocks until io and writer thread dies
+        Blocks until io thread dies
         """
         if self._io_thread is not None:
             self.log.info("Waiting for I/O thread to stop...")
             self.closed = True
             self._io_thread.join()
-
-        if self._writer_thread is not None:
-            self.log.info("Waiting for Writer Thread to stop...")
-            self.closed = True
-            self._writer_thread.join()
+        else:
+            self._close_selector()
 
         self.log.info("All worker threads stopped.")
@@ -4,8 +4,21 @@
 #
 # Copyright (c) 2015-2018 Digi International Inc.
 
-from devicecloud.monitor_tcp import TCPClientManager
+import selectors
+import socket
+import ssl
+import struct
+import threading
+import time
+import unittest
+import zlib
+
+from devicecloud.monitor_tcp import TCPClientManager, PushSession, PushException, \
+    CallbackWorkerPool, _read_msgs, _MSG_HEADER, CONNECTION_RESPONSE, PUBLISH_MESSAGE, \
+    PUBLISH_MESSAGE_RECEIVED, NO_DATA, STATUS_OK, STATUS_UNAUTHORIZED, RECEIVE_BUFFER_SIZE, \
+    SOCKET_RECEIVE_BUFFER_SIZE
 from devicecloud.test.unit.test_utilities import HttpTestBase
+import mock
 
 
 class TestTCPClientManager(HttpTestBase):
@@ -27,3 +40,363 @@ class TestTCPClientManager(HttpTestBase):
 
     def test_password(self):
         self.assertEqual(self.client_manager.password, "pass")
+
+
+class TestPushSessionConnect(unittest.TestCase):
+
+    def setUp(self):
+        client = mock.Mock(username="user", password="pass")
+        self.session = PushSession(None, 1234, client)
+        self.session.socket, self.peer = socket.socketpair()
+
+    def tearDown(self):
+        self.session.stop()
+        self.peer.close()
+
+    def test_connection_request(self):
+        self.peer.send(struct.pack("!HLHH", CONNECTION_RESPONSE, 4, STATUS_OK, 0))
+        self.session.send_connection_request()
+        self.assertEqual(self.peer.recv(1024),
+                         b"\x00\x01\x00\x00\x00\x12\x00\x01"
+                         b"\x00\x04user\x00\x04pass\x00\x00\x04\xd2")
+
+    def test_connection_request_reused(self):
+        self.peer.send(struct.pack("!HLHH", CONNECTION_RESPONSE, 4, STATUS_OK, 0) * 2)
+        self.session.send_connection_request()
+        self.session.client.username = "changed"
+        self.session.send_connection_request()
+        self.assertEqual(self.peer.recv(1024),
+                         (b"\x00\x01\x00\x00\x00\x12\x00\x01"
+                          b"\x00\x04user\x00\x04pass\x00\x00\x04\xd2") * 2)
+
+    def test_socket_options(self):
+        sock = self.session._create_socket()
+        self.addCleanup(sock.close)
+        self.assertTrue(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+        self.assertTrue(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+
+    @mock.patch('devicecloud.monitor_tcp.socket.socket')
+    def test_socket_receive_buffer_size(self, socket_mock):
+        # The kernel may double or cap the requested size, check the request.
+        sock = self.session._create_socket()
+        sock.setsockopt.assert_any_call(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                        SOCKET_RECEIVE_BUFFER_SIZE)
+
+    def test_connection_request_unauthorized(self):
+        self.peer.send(struct.pack("!HLHH", CONNECTION_RESPONSE, 4, STATUS_UNAUTHORIZED, 0))
+        self.assertRaises(PushException, self.session.send_connection_request)
+        self.assertIsNone(self.session.socket)
+
+
+class TestPushSessionRead(unittest.TestCase):
+
+    def setUp(self):
+        self.session = PushSession(None, 1, None)
+        self.session.socket, self.peer = socket.socketpair()
+        self.session.socket.setblocking(0)
+
+    def tearDown(self):
+        self.session.stop()
+        self.peer.close()
+
+    def _publish_message(self, block_id, payload, compression=0x00):
+        message = struct.pack("!HHB5x", block_id, 0, compression) + payload
+        return _MSG_HEADER.pack(PUBLISH_MESSAGE, len(message)) + message
+
+    def test_read_header_incomplete(self):
+        message = self._publish_message(1, b'{}')
+        self.peer.send(message[:4])
+        self.assertEqual(_read_msgs(self.session), [])
+        self.assertIsNone(self.session.response_type)
+        self.assertEqual(self.session.data_length, 4)
+        self.peer.send(message[4:8])
+        self.assertEqual(_read_msgs(self.session), [])
+        self.assertEqual(self.session.response_type, PUBLISH_MESSAGE)
+        self.assertEqual(self.session.message_length, 12)
+        self.assertEqual(self.session.data_length, 2)
+
+    def test_read_closed(self):
+        self.peer.close()
+        self.assertEqual(_read_msgs(self.session), NO_DATA)
+
+    def test_read_not_ready(self):
+        self.assertEqual(_read_msgs(self.session), [])
+
+    def test_read_message_fragmented(self):
+        message = self._publish_message(1, b'{"a": 1}')
+        self.peer.send(message[:12])
+        self.assertEqual(_read_msgs(self.session), [])
+        self.peer.send(message[12:])
+        self.assertEqual(_read_msgs(self.session), [(PUBLISH_MESSAGE, 1, b'{"a": 1}')])
+        self.assertIsNone(self.session.response_type)
+        self.assertEqual(self.session.data_length, 0)
+
+    def test_read_pipelined_messages(self):
+        data = self._publish_message(1, b'{}') + self._publish_message(2, b'[]')
+        data += _MSG_HEADER.pack(CONNECTION_RESPONSE, 2) + b"\0\0"
+        self.peer.send(data + self._publish_message(3, b'{}')[:8])
+        self.assertEqual(_read_msgs(self.session), [
+            (PUBLISH_MESSAGE, 1, b'{}'),
+            (PUBLISH_MESSAGE, 2, b'[]'),
+            (CONNECTION_RESPONSE, None, None),
+        ])
+        self.assertEqual(self.session.response_type, PUBLISH_MESSAGE)
+        self.assertEqual(self.session.data[:self.session.data_length], b"\0\3")
+
+    def test_read_compressed_message(self):
+        payload = b'{"Document": {}}' * 8
+        message = self._publish_message(5, zlib.compress(payload), 0x01)
+        self.peer.send(message[:10])
+        self.assertEqual(_read_msgs(self.session), [])
+        self.assertIsNone(self.session.decompressor)
+        self.peer.send(message[10:30])
+        self.assertEqual(_read_msgs(self.session), [])
+        self.assertIsNotNone(self.session.decompressor)
+        self.peer.send(message[30:])
+        self.assertEqual(_read_msgs(self.session), [(PUBLISH_MESSAGE, 5, payload)])
+        self.assertIsNone(self.session.decompressor)
+
+    def test_read_corrupt_compressed_message(self):
+        self.peer.send(self._publish_message(5, b"not compressed", 0x01) + self._publish_message(6, b'{}'))
+        self.assertEqual(_read_msgs(self.session), [
+            (PUBLISH_MESSAGE, 5, None),
+            (PUBLISH_MESSAGE, 6, b'{}'),
+        ])
+
+    def _ssl_socket(self, *chunks):
+        sock = mock.Mock(spec=ssl.SSLSocket)
+        chunks = list(chunks)
+
+        def recv_into(view):
+            chunk = chunks.pop(0)
+            if isinstance(chunk, Exception):
+                raise chunk
+            view[:len(chunk)] = chunk
+            return len(chunk)
+        sock.recv_into.side_effect = recv_into
+        sock.pending.side_effect = lambda: len(chunks) and not isinstance(chunks[0], Exception)
+        return sock
+
+    def test_read_ssl_pending(self):
+        message = self._publish_message(1, b'{}')
+        self.session.socket.close()
+        self.session.socket = self._ssl_socket(message[:5], message[5:])
+        self.assertEqual(_read_msgs(self.session), [(PUBLISH_MESSAGE, 1, b'{}')])
+
+    def test_read_ssl_want_read(self):
+        self.session.socket.close()
+        self.session.socket = self._ssl_socket(ssl.SSLWantReadError())
+        self.assertEqual(_read_msgs(self.session), [])
+        self.assertFalse(self.session.read_wants_write)
+
+    def test_read_ssl_want_write(self):
+        message = self._publish_message(1, b'{}')
+        self.session.socket.close()
+        self.session.socket = self._ssl_socket(ssl.SSLWantWriteError(), message)
+        self.assertEqual(_read_msgs(self.session), [])
+        self.assertTrue(self.session.read_wants_write)
+        self.assertEqual(_read_msgs(self.session), [(PUBLISH_MESSAGE, 1, b'{}')])
+        self.assertFalse(self.session.read_wants_write)
+
+    def test_read_ssl_error(self):
+        self.session.socket.close()
+        self.session.socket = self._ssl_socket(ssl.SSLError())
+        self.assertRaises(ssl.SSLError, _read_msgs, self.session)
+
+    def test_receive_buffer_resized(self):
+        self.peer.send(_MSG_HEADER.pack(PUBLISH_MESSAGE, RECEIVE_BUFFER_SIZE * 2))
+        _read_msgs(self.session)
+        self.assertEqual(len(self.session.data), RECEIVE_BUFFER_SIZE * 2)
+        self.peer.sendall(b"\0" * RECEIVE_BUFFER_SIZE * 2 + self._publish_message(1, b'{}'))
+        while _read_msgs(self.session) == []:
+            pass
+        self.assertEqual(len(self.session.data), RECEIVE_BUFFER_SIZE)
+
+
+class TestTCPClientManagerWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.client_manager = TCPClientManager(mock.Mock())
+        self.session = PushSession(None, 1, self.client_manager)
+        self.session.socket, self.peer = socket.socketpair()
+        self.session.socket.setblocking(0)
+        self.client_manager._register(self.session)
+
+    def tearDown(self):
+        self.session.stop()
+        self.peer.close()
+
+    def _fill_send_buffer(self):
+        try:
+            while True:
+                self.session.socket.send(b"\0" * 65536)
+        except BlockingIOError:
+            pass
+
+    def _drain_peer(self):
+        self.peer.setblocking(0)
+        try:
+            while True:
+                self.peer.recv(65536)
+        except BlockingIOError:
+            pass
+
+    def test_sessions(self):
+        self.assertEqual(self.client_manager.sessions, {self.session.socket.fileno(): self.session})
+        self.client_manager._unregister(self.session.socket)
+        self.assertEqual(self.client_manager.sessions, {})
+
+    def test_clean_dead_sessions(self):
+        self.session.stop()
+        self.client_manager._clean_dead_sessions()
+        self.assertEqual(self.client_manager.sessions, {})
+
+    def test_stop_closes_selector(self):
+        self.client_manager._init_threads()
+        self.client_manager.stop()
+        self.assertIsNone(self.session.socket)
+        self.assertIsNone(self.client_manager._selector.get_map())
+        self.assertEqual(self.client_manager.sessions, {})
+
+    def _events(self):
+        return self.client_manager._selector.get_key(self.session.socket).events
+
+    def test_write_coalesced(self):
+        self.client_manager._write(self.session, b"one")
+        self.client_manager._write(self.session, b"two")
+        self.assertEqual(self.client_manager._pending_writes[self.session], b"onetwo")
+        self.assertEqual(self._events(), selectors.EVENT_READ)
+
+        self.client_manager._flush_all_writes()
+        self.assertEqual(self.client_manager._pending_writes, {})
+        self.assertEqual(self._events(), selectors.EVENT_READ)
+        self.assertEqual(self.peer.recv(6), b"onetwo")
+
+    def test_write_not_ready(self):
+        self._fill_send_buffer()
+        self.client_manager._write(self.session, b"ack")
+        self.client_manager._flush_writes(self.session)
+        self.assertEqual(self.client_manager._pending_writes[self.session], b"ack")
+        self.assertEqual(self._events(), selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+        self._drain_peer()
+        self.client_manager._flush_writes(self.session)
+        self.assertEqual(self.client_manager._pending_writes, {})
+        self.assertEqual(self._events(), selectors.EVENT_READ)
+        self.peer.setblocking(1)
+        self.assertEqual(self.peer.recv(3), b"ack")
+
+    def test_write_waiting_writable_skipped(self):
+        self._fill_send_buffer()
+        self.client_manager._write(self.session, b"ack")
+        self.client_manager._flush_all_writes()
+        self.assertEqual(self._events(), selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+        self._drain_peer()
+        self.client_manager._flush_all_writes()
+        self.assertEqual(self.client_manager._pending_writes[self.session], b"ack")
+
+    def test_write_from_worker_wakes_io_thread(self):
+        self.session.callback = mock.Mock(return_value=True)
+        self.client_manager._init_threads()
+        try:
+            message = struct.pack("!HHB5x", 7, 0, 0x00) + b'{}'
+            start = time.time()
+            self.peer.sendall(_MSG_HEADER.pack(PUBLISH_MESSAGE, len(message)) + message)
+            self.peer.settimeout(5)
+            ack = self.peer.recv(6)
+            elapsed = time.time() - start
+        finally:
+            self.client_manager.stop()
+        self.session.callback.assert_called_once_with({})
+        self.assertEqual(ack, struct.pack("!HHH", PUBLISH_MESSAGE_RECEIVED, 7, STATUS_OK))
+        # Well under the select timeout the ack would otherwise wait for.
+        self.assertLess(elapsed, 0.05)
+
+    def test_write_ssl_want_read(self):
+        self.session.socket = mock.Mock(wraps=self.session.socket)
+        self.session.socket.send.side_effect = ssl.SSLWantReadError()
+        self.client_manager._write(self.session, b"ack")
+        self.client_manager._flush_writes(self.session)
+        # The socket is writable already, waiting for that would spin.
+        self.assertEqual(self._events(), selectors.EVENT_READ)
+        self.assertEqual(self.client_manager._write_waits[self.session], selectors.EVENT_READ)
+        self.client_manager._flush_all_writes()
+        self.assertEqual(self.session.socket.send.call_count, 1)
+
+        self.session.socket.send.side_effect = None
+        self.session.socket.send.return_value = 3
+        self.client_manager._flush_writes(self.session)
+        self.assertEqual(self.client_manager._pending_writes, {})
+        self.assertEqual(self.client_manager._write_waits, {})
+
+    def test_read_wants_write(self):
+        self.session.read_wants_write = True
+        self.client_manager._update_events(self.session)
+        self.assertEqual(self._events(), selectors.EVENT_READ | selectors.EVENT_WRITE)
+        self.session.read_wants_write = False
+        self.client_manager._update_events(self.session)
+        self.assertEqual(self._events(), selectors.EVENT_READ)
+
+    def test_write_peer_closed(self):
+        self.client_manager._restart_session = mock.Mock()
+        self.client_manager._write(self.session, b"ack")
+        self.peer.close()
+        self.client_manager._flush_writes(self.session)
+        self.assertEqual(self.client_manager._pending_writes, {})
+        self.client_manager._restart_session.assert_called_once_with(self.session)
+
+    def test_write_dropped_on_unregister(self):
+        self._fill_send_buffer()
+        self.client_manager._write(self.session, b"ack")
+        self.client_manager._unregister(self.session.socket)
+        self.assertEqual(self.client_manager._pending_writes, {})
+
+
+class TestCallbackWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = mock.Mock()
+        self.pool = CallbackWorkerPool(self.writer, size=0)
+        self.session = mock.Mock(raw=False)
+
+    def test_inline_callback_acknowledged(self):
+        self.session.callback.return_value = True
+        self.pool.queue_callback(self.session, 7, b'{"Document": {"Msg": {}}}')
+        self.session.callback.assert_called_once_with({"Document": {"Msg": {}}})
+        self.writer.assert_called_once_with(
+            self.session, struct.pack("!HHH", PUBLISH_MESSAGE_RECEIVED, 7, STATUS_OK))
+
+    def test_inline_callback_not_acknowledged(self):
+        self.session.callback.return_value = False
+        self.pool.queue_callback(self.session, 7, b'{}')
+        self.session.callback.assert_called_once_with({})
+        self.assertFalse(self.writer.called)
+
+    def test_inline_callback_raw(self):
+        self.session.raw = True
+        self.session.callback.return_value = True
+        self.pool.queue_callback(self.session, 7, b'{"Document": {"Msg": {}}}')
+        self.session.callback.assert_called_once_with(b'{"Document": {"Msg": {}}}')
+        self.assertTrue(self.writer.called)
+
+    def test_invalid_payload_ignored(self):
+        self.pool.queue_callback(self.session, 7, b'{')
+        self.assertFalse(self.session.callback.called)
+        self.assertFalse(self.writer.called)
+
+    def test_worker_callbacks_in_order(self):
+        pool = CallbackWorkerPool(self.writer, size=2)
+        received = []
+        done = threading.Event()
+
+        def callback(data):
+            received.append(data)
+            if len(received) == 100:
+                done.set()
+            return True
+        self.session.callback = callback
+        for i in range(100):
+            pool.queue_callback(self.session, i, str(i).encode())
+        self.assertTrue(done.wait(5))
+        self.assertEqual(received, list(range(100)))